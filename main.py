@@ -1,25 +1,470 @@
 import streamlit as st
 import os
-from dotenv import load_dotenv
-import google.generativeai as genai # This is the official Google GenAI client library
+import time
+import json
+import hashlib
+import asyncio
+import threading
+import collections
+import uuid
+import gc
+import sqlite3
 
-# Load environment variables from .env file
-load_dotenv()
+# Each rerun creates lots of short-lived objects, which triggers frequent garbage collection
+# passes. Once per process, move everything loaded so far out of the collector's view and
+# collect less often; collection stays enabled so cyclic garbage is still freed.
+GC_THRESHOLDS = (50_000, 20, 20)
 
-# Configure the Gemini API key
-gemini_api_key = os.getenv("GEMINI_API_KEY")
+@st.cache_resource
+def tune_gc():
+    gc.collect()
+    gc.freeze()
+    gc.set_threshold(*GC_THRESHOLDS)
+
+tune_gc()
+
+# Load the .env file once per process. It can hold the optional backend settings
+# (REDIS_URL, CHAT_DB_PATH) as well as the key, so it is read even when the key comes
+# from elsewhere; values already in the environment are not overridden.
+@st.cache_resource
+def load_env():
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    load_dotenv()
+
+load_env()
+
+# Look up the Gemini API key once per process: Streamlit secrets first (the standard place on
+# Streamlit Cloud), then the environment and .env file
+@st.cache_resource
+def get_api_key():
+    try:
+        api_key = st.secrets.get("GEMINI_API_KEY")
+    except FileNotFoundError:
+        # No secrets.toml file
+        api_key = None
+    return api_key or os.getenv("GEMINI_API_KEY")
+
+gemini_api_key = get_api_key()
 
 if not gemini_api_key:
-    st.error("GEMINI_API_KEY not found in environment variables. Please set it in a .env file.")
+    # Don't keep the missing key cached, so it is picked up once it has been set
+    load_env.clear()
+    get_api_key.clear()
+    st.error("GEMINI_API_KEY not found. Please set it in Streamlit secrets or in a .env file.")
     st.stop()
 
-# Configure the generative model
-genai.configure(api_key=gemini_api_key)
-model = genai.GenerativeModel('gemini-2.0-flash') # Using the standard Gemini model directly
-
 # Agent's instructions
 AGENT_INSTRUCTIONS = "You are a helpful frontend developer who helps people to create their own frontends."
 
+# Reply stored in place of an answer when a request fails
+ERROR_REPLY = "Sorry, I encountered an error. Please try again."
+
+# Initial greeting from the agent, shown at the start of every new session
+GREETING = {"role": "assistant", "content": "Hello! I am your Frontend Master. How can I help you create a frontend for your business today?"}
+
+# Configure the generative model once per process and share it across sessions;
+# the instructions are sent once as the system instruction. The SDK is slow to import,
+# so it is only loaded the first time a reply is actually requested.
+@st.cache_resource
+def get_model():
+    import google.generativeai as genai # This is the official Google GenAI client library
+    genai.configure(api_key=gemini_api_key)
+    return genai.GenerativeModel('gemini-2.0-flash', system_instruction=AGENT_INSTRUCTIONS)
+
+def get_chat():
+    """Return the session's chat, starting it from the stored messages on first use."""
+    if "chat" in st.session_state:
+        from google.generativeai.types.generation_types import BrokenResponseError, IncompleteIterationError
+        try:
+            st.session_state.chat.history
+        except (BrokenResponseError, IncompleteIterationError):
+            # The last reply was interrupted (e.g. by a rerun) before it finished; start
+            # over from the stored messages, which also releases the stale response
+            del st.session_state.chat
+    if "chat" not in st.session_state:
+        # Chat session keeps the conversation history so the model remembers earlier turns
+        st.session_state.chat = get_model().start_chat(history=to_chat_history(st.session_state.messages))
+        st.session_state.summary_in_history = False
+    return st.session_state.chat
+
+# Gemini calls run on one shared event loop in a background thread, so requests from
+# concurrent sessions overlap instead of queueing behind each other
+@st.cache_resource
+def get_event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+# Longest wait for a single API call (or a single streamed chunk) before giving up
+REQUEST_TIMEOUT = 60
+
+def run_async(coro, timeout=REQUEST_TIMEOUT):
+    """Run a coroutine on the shared event loop and wait for its result."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        # Timed out or interrupted by a rerun: don't leave the call running on the loop
+        future.cancel()
+        raise
+
+async def _next_chunk(iterator):
+    return await anext(iterator)
+
+async def _close_response(response):
+    """Close the API stream behind a Gemini response that wasn't read to the end."""
+    # The SDK keeps the API stream in a private attribute and has no public way to close it
+    stream = getattr(response, "_iterator", None)
+    if stream is not None and hasattr(stream, "aclose"):
+        await stream.aclose()
+
+def iter_async(response):
+    """Iterate a streamed Gemini response from the script thread, one chunk at a time."""
+    iterator = aiter(response)
+    finished = False
+    try:
+        while True:
+            try:
+                yield run_async(_next_chunk(iterator))
+            except StopAsyncIteration:
+                finished = True
+                return
+    finally:
+        # When the rerun stops reading early, close both the SDK's iterator and the API
+        # stream underneath it, so the server stops generating
+        run_async(iterator.aclose())
+        if not finished:
+            run_async(_close_response(response))
+
+# Streaming settings: large chunks are split into smaller pieces so the reply "types" smoothly.
+# Each chunk gets a fixed time budget however long it is, so smoothing never slows the reply
+# down by more than a fraction of a second per chunk.
+STREAM_MAX_CHUNK_CHARS = 50
+STREAM_PIECE_CHARS = 4
+STREAM_CHUNK_BUDGET = 0.1
+
+# Finish reasons of a reply that ended normally; anything else (SAFETY, RECITATION, ...)
+# means the reply was cut short and must not be treated as an answer
+OK_FINISH_REASONS = {"FINISH_REASON_UNSPECIFIED", "STOP", "MAX_TOKENS"}
+
+def stream_text(response):
+    """Yield the text of a streamed Gemini response, re-chunking oversized chunks."""
+    for chunk in response:
+        if not chunk.candidates:
+            if chunk.prompt_feedback.block_reason:
+                raise ValueError(f"The question was blocked ({chunk.prompt_feedback.block_reason.name}).")
+            # The last chunk may only carry usage metadata
+            continue
+        candidate = chunk.candidates[0]
+        if candidate.finish_reason.name not in OK_FINISH_REASONS:
+            raise ValueError(f"The reply was stopped early ({candidate.finish_reason.name}).")
+        if not candidate.content.parts:
+            # The last chunk may only carry the finish reason
+            continue
+        text = chunk.text
+        if len(text) <= STREAM_MAX_CHUNK_CHARS:
+            yield text
+            continue
+        pieces = range(0, len(text), STREAM_PIECE_CHARS)
+        delay = STREAM_CHUNK_BUDGET / len(pieces)
+        for i in pieces:
+            yield text[i:i + STREAM_PIECE_CHARS]
+            time.sleep(delay)
+
+# Only the most recent messages are kept per session, so memory use stays constant
+MAX_HISTORY_MESSAGES = 40
+
+# The history sent to the model is also capped by token count; older turns are dropped
+# and folded into a short running summary that is sent in their place
+HISTORY_TOKEN_BUDGET = 4096
+SUMMARY_PREFIX = "Summary of our earlier conversation:\n"
+SUMMARY_ACK = "Thanks, I'll keep that in mind."
+CHARS_PER_TOKEN = 4
+# Dropped turns waiting to be summarized are capped, keeping the most recent text
+MAX_DROPPED_CHARS = HISTORY_TOKEN_BUDGET * CHARS_PER_TOKEN
+
+def count_tokens(text):
+    """Rough local token estimate; exact counts would cost an API round trip per message."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def content_text(content):
+    return "".join(part.text for part in content.parts)
+
+async def summarize(model, summary, dropped_text):
+    request = (
+        "Briefly summarize this conversation between a user and a frontend development "
+        "assistant, keeping any details needed to continue it.\n\n"
+        f"{summary}\n\n{dropped_text}"
+    )
+    response = await asyncio.wait_for(model.generate_content_async(request), REQUEST_TIMEOUT)
+    return response.text
+
+def update_summary():
+    """Pick up a finished summary and start summarizing any newly dropped turns."""
+    future = st.session_state.get("summary_future")
+    if future is not None:
+        if not future.done():
+            return
+        try:
+            st.session_state.summary = future.result()
+        except Exception:
+            # Keep the previous summary; the dropped turns are simply lost
+            pass
+        st.session_state.summary_future = None
+    dropped_text = st.session_state.get("dropped_text", "")
+    if dropped_text:
+        st.session_state.dropped_text = ""
+        # Runs in the background; the result is used from the next turn onwards
+        st.session_state.summary_future = asyncio.run_coroutine_threadsafe(
+            summarize(get_model(), st.session_state.get("summary", ""), dropped_text),
+            get_event_loop(),
+        )
+
+def fit_chat_history(chat):
+    """Keep the most recent turns that fit the message and token budgets, plus the summary."""
+    history = list(chat.history)
+    # The summary turns are rebuilt below, so set them aside first
+    if st.session_state.get("summary_in_history"):
+        history = history[2:]
+
+    dropped = []
+    while len(history) > 2 and (
+        len(history) > MAX_HISTORY_MESSAGES
+        or sum(count_tokens(content_text(c)) for c in history) > HISTORY_TOKEN_BUDGET
+    ):
+        # Drop up to the next user turn so the history still starts with one
+        dropped.append(history.pop(0))
+        while history and history[0].role != "user":
+            dropped.append(history.pop(0))
+
+    if dropped:
+        lines = [f"{c.role}: {content_text(c)}" for c in dropped]
+        dropped_text = "\n".join([st.session_state.get("dropped_text", ""), *lines]).strip()
+        st.session_state.dropped_text = dropped_text[-MAX_DROPPED_CHARS:]
+    update_summary()
+
+    summary = st.session_state.get("summary")
+    if summary:
+        history = [
+            {"role": "user", "parts": [SUMMARY_PREFIX + summary]},
+            {"role": "model", "parts": [SUMMARY_ACK]},
+            *history,
+        ]
+    st.session_state.summary_in_history = bool(summary)
+    chat.history = history
+
+# Optional Redis backend: when REDIS_URL is set, chat history and cached replies are stored
+# in Redis so several app replicas can run behind a load balancer without sticky sessions
+@st.cache_resource
+def get_redis():
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        return None
+    try:
+        import redis # Only needed when a Redis backend is configured
+    except ImportError:
+        st.error("REDIS_URL is set but the redis package isn't installed. Install it with `pip install redis`.")
+        st.stop()
+    return redis.Redis.from_url(redis_url, decode_responses=True)
+
+# Stored sessions expire after a week without new messages
+SESSION_TTL = 7 * 24 * 3600
+
+def storage_failed(e):
+    """Report a Redis or SQLite error; the app keeps working from memory for this turn."""
+    st.toast(f"Chat storage is unavailable, continuing without it: {e}")
+
+def get_session_id():
+    """Session id kept in the page URL so a browser refresh lands on the same history.
+
+    The id is the only thing protecting a stored conversation: anyone with the link can
+    read and continue it. It is only added when a storage backend is configured.
+    """
+    sid = st.query_params.get("sid")
+    if not sid:
+        sid = uuid.uuid4().hex
+        st.query_params["sid"] = sid
+    return sid
+
+# Optional SQLite backend for single-server deployments: when CHAT_DB_PATH is set (and Redis
+# isn't configured), messages are appended to a local database so history survives a refresh
+@st.cache_resource
+def open_db(db_path):
+    # Shared by all script threads; writes are serialized with the lock
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    with conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS msgs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, sid TEXT, role TEXT, content TEXT, ts REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS msgs_sid ON msgs (sid, id)")
+    return conn, threading.Lock()
+
+def get_db():
+    """The SQLite connection and its lock, or None when not configured or unavailable."""
+    db_path = os.getenv("CHAT_DB_PATH")
+    if not db_path:
+        return None
+    try:
+        return open_db(db_path)
+    except sqlite3.Error as e:
+        # Not cached, so the database is tried again on the next call
+        storage_failed(e)
+        return None
+
+def load_messages(sid):
+    """Load a session's stored messages (empty when no backend is configured)."""
+    if sid is None:
+        return []
+    r = get_redis()
+    if r is not None:
+        try:
+            return [json.loads(m) for m in r.lrange(f"msgs:{sid}", -MAX_HISTORY_MESSAGES, -1)]
+        except Exception as e:
+            storage_failed(e)
+            return []
+    db = get_db()
+    if db is not None:
+        conn, lock = db
+        try:
+            with lock:
+                rows = conn.execute(
+                    "SELECT role, content FROM ("
+                    "SELECT id, role, content FROM msgs WHERE sid = ? ORDER BY id DESC LIMIT ?"
+                    ") ORDER BY id",
+                    (sid, MAX_HISTORY_MESSAGES),
+                ).fetchall()
+        except sqlite3.Error as e:
+            storage_failed(e)
+            return []
+        return [{"role": role, "content": content} for role, content in rows]
+    return []
+
+def add_message(role, content):
+    """Append a message to the session history and mirror it to the configured backend."""
+    message = {"role": role, "content": content}
+    st.session_state.messages.append(message)
+    if st.session_state.sid is None:
+        return
+    r = get_redis()
+    if r is not None:
+        key = f"msgs:{st.session_state.sid}"
+        try:
+            pipe = r.pipeline()
+            pipe.rpush(key, json.dumps(message))
+            pipe.ltrim(key, -MAX_HISTORY_MESSAGES, -1)
+            pipe.expire(key, SESSION_TTL)
+            pipe.execute()
+        except Exception as e:
+            storage_failed(e)
+        return
+    db = get_db()
+    if db is not None:
+        conn, lock = db
+        try:
+            with lock, conn:
+                conn.execute(
+                    "INSERT INTO msgs (sid, role, content, ts) VALUES (?, ?, ?, ?)",
+                    (st.session_state.sid, role, content, time.time()),
+                )
+        except sqlite3.Error as e:
+            storage_failed(e)
+
+def to_chat_history(messages):
+    """Convert stored messages to Gemini chat history (which has to start with a user turn)."""
+    history = []
+    for message in messages:
+        if message["role"] == "user":
+            # A user turn that never got a reply (e.g. interrupted by a rerun) is dropped
+            # so the history keeps alternating between user and model
+            if history and history[-1]["role"] == "user":
+                history.pop()
+            history.append({"role": "user", "parts": [message["content"]]})
+        elif message["content"] == ERROR_REPLY:
+            # Failed turns aren't part of the conversation the model saw
+            if history and history[-1]["role"] == "user":
+                history.pop()
+        elif history and history[-1]["role"] == "user":
+            history.append({"role": "model", "parts": [message["content"]]})
+    if history and history[-1]["role"] == "user":
+        history.pop()
+    return history
+
+# Reply cache: repeated questions with the same recent context are served from memory
+# (or from Redis, shared across replicas, when it is configured)
+RESPONSE_CACHE_TTL = 3600
+RESPONSE_CACHE_MAX_ENTRIES = 512
+HISTORY_KEY_TURNS = 6
+
+@st.cache_resource
+def get_response_cache():
+    """Process-wide reply cache shared by all sessions: {key: (timestamp, reply)} and its lock."""
+    return {}, threading.Lock()
+
+def history_key(messages):
+    """Hash the last few messages so cached replies are scoped to the recent context."""
+    recent = json.dumps(list(messages)[-HISTORY_KEY_TURNS:])
+    return hashlib.blake2b(recent.encode(), digest_size=8).hexdigest()
+
+def reply_key(prompt, key):
+    digest = hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+    return f"reply:{key}:{digest}"
+
+def get_cached_response(prompt, key):
+    r = get_redis()
+    if r is not None:
+        try:
+            return r.get(reply_key(prompt, key))
+        except Exception as e:
+            storage_failed(e)
+            return None
+    cache, lock = get_response_cache()
+    with lock:
+        entry = cache.get((prompt, key))
+    if entry is None or time.time() - entry[0] > RESPONSE_CACHE_TTL:
+        return None
+    return entry[1]
+
+def cache_response(prompt, key, reply):
+    """Store a reply from a stream that finished cleanly; empty replies are never cached."""
+    if not reply:
+        return
+    r = get_redis()
+    if r is not None:
+        try:
+            r.setex(reply_key(prompt, key), RESPONSE_CACHE_TTL, reply)
+        except Exception as e:
+            storage_failed(e)
+        return
+    cache, lock = get_response_cache()
+    with lock:
+        cache[(prompt, key)] = (time.time(), reply)
+        # Dicts keep insertion order, so the first keys are the oldest entries
+        while len(cache) > RESPONSE_CACHE_MAX_ENTRIES:
+            cache.pop(next(iter(cache)))
+
+# Number of alternative answers produced by a single "regenerate" request
+REGENERATE_CANDIDATES = 3
+
+def regenerate_n(history, n=REGENERATE_CANDIDATES):
+    """Ask for n alternative replies to the last user turn in one batched API call."""
+    response = run_async(get_model().generate_content_async(history, generation_config={"candidate_count": n}))
+    replies = []
+    # Each candidate can fail on its own (e.g. blocked by safety filters), so check them separately
+    for i, candidate in enumerate(response.candidates, start=1):
+        reason = candidate.finish_reason.name
+        text = "".join(part.text for part in candidate.content.parts)
+        if reason not in OK_FINISH_REASONS:
+            replies.append(f"Alternative {i} could not be generated ({reason}).")
+        elif not text:
+            replies.append(f"Alternative {i} could not be generated (empty reply).")
+        else:
+            replies.append(text)
+    return replies
+
 st.set_page_config(page_title="White-box.AI", layout="centered")
 
 st.title("White-box , The Ultimate Frontend Master Chatbot")
@@ -27,9 +472,13 @@ st.markdown("---")
 
 # Initialize chat history in session state if it doesn't exist
 if "messages" not in st.session_state:
-    st.session_state.messages = []
-    # Add initial greeting from the agent
-    st.session_state.messages.append({"role": "assistant", "content": "Hello! I am your Frontend Master. How can I help you create a frontend for your business today?"})
+    # Without a storage backend there is nothing to resume, so the URL is left alone
+    has_backend = get_redis() is not None or get_db() is not None
+    st.session_state.sid = get_session_id() if has_backend else None
+    st.session_state.messages = collections.deque(load_messages(st.session_state.sid), maxlen=MAX_HISTORY_MESSAGES)
+    if not st.session_state.messages:
+        # Add initial greeting from the agent
+        add_message(GREETING["role"], GREETING["content"])
 
 # Display chat messages from history on app rerun
 for message in st.session_state.messages:
@@ -38,36 +487,74 @@ for message in st.session_state.messages:
 
 # Main chat input field
 if prompt := st.chat_input("Type your message..."):
+    chat = get_chat()
+    # Key the reply cache on the context the question was asked in
+    context_key = history_key(st.session_state.messages)
     # Add user message to chat history
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    add_message("user", prompt)
     # Display user message
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # Prepare the prompt for the Gemini model, incorporating agent instructions
-    full_prompt_text = f"{AGENT_INSTRUCTIONS}\n\nUser: {prompt}\nFrontend Master:"
-
-    # Display a loading message/spinner
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            try:
-                # Call the Gemini API
-                response = model.generate_content(full_prompt_text)
+        try:
+            fit_chat_history(chat)
+            assistant_response = get_cached_response(prompt, context_key)
+            if assistant_response is not None:
+                # Cache hit: show the stored reply and keep the chat session's history in sync
+                st.markdown(assistant_response)
+                chat.history = [
+                    *chat.history,
+                    {"role": "user", "parts": [prompt]},
+                    {"role": "model", "parts": [assistant_response]},
+                ]
+            else:
+                # Call the Gemini API and stream the reply as it arrives
+                with st.spinner("Thinking..."):
+                    response = run_async(chat.send_message_async(prompt, stream=True))
 
-                # Get the assistant's response
-                assistant_response = response.text
+                # Display assistant response chunk by chunk; returns the full text once done
+                assistant_response = st.write_stream(stream_text(iter_async(response)))
+                if not assistant_response:
+                    raise ValueError("The model returned an empty reply.")
+                # Only reached when the stream finished cleanly; cut-off replies raise above
+                cache_response(prompt, context_key, assistant_response)
 
-                # Display assistant response
-                st.markdown(assistant_response)
+            # Add assistant response to chat history
+            add_message("assistant", assistant_response)
 
-                # Add assistant response to chat history
-                st.session_state.messages.append({"role": "assistant", "content": assistant_response})
+        except Exception as e:
+            error_message = f"An error occurred: {e}"
+            st.error(error_message)
+            add_message("assistant", ERROR_REPLY)
+            # A failed or blocked stream leaves the chat session unusable, so rebuild it
+            # from the stored messages on the next turn
+            del st.session_state.chat
 
+# Offer alternative answers to the last question. This runs as a fragment, so clicking the
+# button reruns only this panel instead of re-sending the whole transcript to the browser.
+@st.fragment
+def alternatives_panel():
+    # Chat history ends with the model's reply; there is none before the first question
+    try:
+        chat_history = st.session_state.chat.history if "chat" in st.session_state else []
+    except Exception:
+        # The last reply failed part way; there is nothing to regenerate from
+        chat_history = []
+    if chat_history and st.button("Show alternative answers"):
+        with st.spinner("Generating alternatives..."):
+            try:
+                alternatives = regenerate_n(chat_history[:-1])
             except Exception as e:
-                error_message = f"An error occurred: {e}"
-                st.error(error_message)
-                st.session_state.messages.append({"role": "assistant", "content": "Sorry, I encountered an error. Please try again."})
+                st.error(f"An error occurred: {e}")
+                alternatives = []
+        if alternatives:
+            tabs = st.tabs([f"Answer {i}" for i in range(1, len(alternatives) + 1)])
+            for tab, alternative in zip(tabs, alternatives):
+                with tab:
+                    st.markdown(alternative)
 
+alternatives_panel()
 
 # Add a sidebar for more information (optional, but good for professional apps)
 with st.sidebar: